@@ -4,7 +4,13 @@
 #   outputs to csv.
 #
 #   Syntax:
-#   python exec_sc.py
+#   python exec_sc.py [--verbose] [--psse-arrays [--dump-reports]]
+#
+#   --verbose       Echo each parsed bus record to the console.
+#   --psse-arrays   Read fault results straight from PSS/e instead of parsing
+#                   the text reports. Experimental, see read_fault_arrays().
+#   --dump-reports  With --psse-arrays, still write the text reports for
+#                   debugging.
 #
 #   Instructions:
 #   Ensure the list of savecases (arrCases) and buses (arrBuses) are populated.
@@ -18,20 +24,28 @@
 
 # ---- Start of imports -------------------------------------------------------
 # System imports start here
-import os, sys      # For system calls
+import os, sys      # For system calls, parsing CWD
 import re           # Regex
+import csv          # Writing results
 import math
-import glob         # Parsing CWD
+import cmath        # Thevenin impedance angle
+import mmap         # Scanning reports in place
+import locale
+import multiprocessing  # Running basecases in parallel
 
 # ---- Initialize program settings for PSSE run outside of GUI ----------------
-PSSE_LOCATION   = "C:\Program Files (x86)\PTI\PSSE34\PSSBIN"
+PSSE_LOCATION   = r"C:\Program Files (x86)\PTI\PSSE34\PSSBIN"
 
-sys.path.append(PSSE_LOCATION)
-os.environ["PATH"] = os.environ["PATH"] + ";" + PSSE_LOCATION
+# Only add PSSE once, since pool workers re-import this module
+if(PSSE_LOCATION not in sys.path):
+    sys.path.append(PSSE_LOCATION)
+if(PSSE_LOCATION not in os.environ["PATH"].split(os.pathsep)):
+    os.environ["PATH"] = PSSE_LOCATION + os.pathsep + os.environ["PATH"]
 
 # ---- Resuming imports -------------------------------------------------------
 import psse34
 import psspy
+import pssarrays
 import redirect
 
 redirect.psse2py()
@@ -60,7 +74,8 @@ arrCsvHeaders   = [ "case",
                     "name",
                     "MVA",
                     "amps",
-                    "impedance",
+                    "Zmag",
+                    "Zang",
                     "X/R"
                     ]   # End of arrCsvHeaders
 
@@ -69,74 +84,177 @@ arrCsvHeaders   = [ "case",
 strReports      = "sc_report_-_"
 strProg         = "sc_prog_-_"                  # This one is just there for conformity
 
+# Echo parsed bus records to the console
+bVerbose        = "--verbose" in sys.argv
+
+# Read fault results from PSS/e arrays, and optionally keep the text reports
+bPsseArrays     = "--psse-arrays" in sys.argv
+bDumpReports    = "--dump-reports" in sys.argv
+
 csvDelim        = ","
 csvEOL          = "\n"
+csvBufSize      = 1 << 20                       # 1 MiB file buffer for csv output
 
 dictExt         = { "ext_csv"   : ".csv",
                     "ext_txt"   : ".txt"
                     }
 
-# Regex strings, expecting each bus entry to have this line precede data:
+# Regex pattern, expecting each bus entry to have this line precede data:
 # X------------ BUS ------------X          MVA        AMP      DEG       AMP       AMP       AMP       AMP       AMP
 #   2024     [MyBusName   100.00] 3PH    2573.54   14858.3   -88.07   40041.5   39580.3        0.0   13702.0   13702.0
 # THEVENIN IMPEDANCE, X/R  (OHM)    Z+:/4.274/88.066, 29.60898
 #
-reHeaderLine    = "X------------ BUS ------------X"
-reBus           = "\d{1,}"                                      # Bus numbers with at least 1 digit
-reName          = "\[(.+?)\]"
-reMVA           = "3PH[\s]*([\d]*\.[\d]*)"
-reAmps          = "3PH[\s]*[\d]*\.[\d]*[\s]*([\d]*\.[\d]*)"
-reImp           = "THEVENIN IMPEDANCE.*Z\+\:(.*)\,"
-reXR            = "THEVENIN IMPEDANCE.*\, ([\d]*\.[\d]*)"
+# Reports are scanned as raw bytes out of a memory map, so the pattern is bytes
+# too. One pattern captures the header, data, and impedance lines of a bus
+# record, with every field as a named group, so the whole report is walked by a
+# single finditer. It starts with the literal header and is not anchored with
+# ^, which lets the regex engine jump straight between headers.
+bHeaderLine     = b"X------------ BUS ------------X"
+reBusRecord     = re.compile(   re.escape(bHeaderLine) + rb"[^\n]*\n"
+                                rb"[ \t]*(?P<bus>\d+)[ \t]*\[(?P<name>[^\]\n]+?)\][^\d\n]*"
+                                rb"3PH[ \t]+(?P<mva>[\d.]+)[ \t]+(?P<amps>[\d.]+)[^\n]*\n"
+                                rb"[^\n]*THEVENIN IMPEDANCE[^\n]*Z\+:[ \t]*/(?P<zmag>[\d.]+)/(?P<zang>-?[\d.]+),[ \t]*(?P<xr>[\d.]+)"
+                                )
+
+# Encoding used to decode the captured fields. Same as the default for reports
+# opened in text mode.
+strEncoding     = locale.getpreferredencoding(False)
 
 # ---- End of   global definitions --------------------------------------------
 
 
-# ---- Start of main() --------------------------------------------------------
-if __name__ == "__main__":
+# ---- Start of start_psse() --------------------------------------------------
+# Set once PSS/e has been started in this process
+bPsseStarted    = False
 
-    # Setup csv output file
-    fCsv    = open( "sc_results" + dictExt["ext_csv"],
-                    "w"
-                    )
+def start_psse():
+    # Start PSS/e once in each worker process. This runs from run_case() and
+    # not as the pool initializer: a pool keeps respawning workers whose
+    # initializer raises, so a failed start (no licence, PSSBIN not found) would
+    # hang the run instead of failing it.
+    global bPsseStarted
 
-    # Write headers
-    for index, indCol in enumerate(arrCsvHeaders):
-        fCsv.write(indCol)
-        
-        if(index < (len(arrCsvHeaders) - 1)):
-            fCsv.write(csvDelim)
-    fCsv.write(csvEOL)
+    if(bPsseStarted):
+        return
 
-    # Start PSS/e
     iErr = psspy.psseinit()
+
+    # Set up SC reporting options. These are program settings that stay in
+    # place when a new case is loaded, so they are only set once per worker.
+    psspy.short_circuit_units(          ival    = 1)            # physical units
+    psspy.short_circuit_z_units(        ival    = 1)            # physical units
+    psspy.short_circuit_coordinates(    ival    = 1)            # polar coordinates
+    psspy.short_circuit_z_coordinates(  ival    = 0)            # polar coordinates
+
+    # Set report page length
+    psspy.lines_per_page_one_device(    device  = 1,
+                                        ival    = 60)
+
+    bPsseStarted = True
+
+# ---- End   of start_psse() --------------------------------------------------
+
+
+# ---- Start of read_fault_arrays() -------------------------------------------
+def read_fault_arrays(sCaseName, mySid):
+    # Runs the 3ph fault on the buses in subsystem mySid through
+    # pssarrays.iecs_currents and returns the csv rows, in arrCsvHeaders order,
+    # without going through the text report.
+    #
+    # Only used with --psse-arrays. The result fields used below (fltbus,
+    # flt3ph[].ia1 in amps, thevzpu[].z1 in pu on system base) have not yet been
+    # checked against the report on a PSS/e install, so the report parse stays
+    # the default until they have.
+    rlst = pssarrays.iecs_currents( sid     = mySid,
+                                    all     = 0,        # process only buses in subsystem SID
+                                    flt3ph  = 1,        # include 3ph faults
+                                    fltlg   = 0,        # no lg faults
+                                    fltllg  = 0,        # no llg faults
+                                    fltll   = 0,        # no ll faults
+                                    fltloc  = 0,        # fault at network bus
+                                    linout  = 0,        # no line out faults
+                                    linend  = 0,        # no line end faults
+                                    tpunty  = 2,        # set tap ratios and phase shift angles to 0 in all seq
+                                    lnchrg  = 2,        # set line charging to 0 in all seq
+                                    shntop  = 2,        # set line, fixed, and switched shunts, and magnetizing admittance to 0 in all seq
+                                    dcload  = 0,        # DC line and FACTS blocked
+                                    zcorec  = 0,        # ignore zero seq transformer impedance
+                                    loadop  = 2,        # set loads to 0 in all seq
+                                    genxop  = 1         # use transient reactance
+                                    )
+    if(rlst.ierr):
+        raise RuntimeError("[" + sCaseName + "]: iecs_currents failed with ierr = " + str(rlst.ierr))
+
+    fSBase  = psspy.sysmva()
+    arrRows = []
+
+    for index, iBus in enumerate(rlst.fltbus):
+        # Extended bus name (name and base kV), as printed in the report
+        iErr, strName   = psspy.notona(iBus)
+        iErr, fBaseKV   = psspy.busdat(iBus, "BASE")
+
+        # 3ph fault current and MVA
+        fAmps   = abs(rlst.flt3ph[index].ia1)
+        fMVA    = math.sqrt(3) * fBaseKV * fAmps / 1000.0
+
+        # Thevenin impedance, pu on system base to ohms
+        cZ      = rlst.thevzpu[index].z1 * fBaseKV * fBaseKV / fSBase
+
+        arrRows.append((sCaseName,
+                        str(iBus),
+                        strName
+                        ) + tuple(  repr(float(field))
+                                    for field in (  fMVA,
+                                                    fAmps,
+                                                    abs(cZ),
+                                                    math.degrees(cmath.phase(cZ)),
+                                                    cZ.imag / cZ.real
+                                                    )
+                                    ))
+
+    return arrRows
+
+# ---- End   of read_fault_arrays() -------------------------------------------
+
+
+# ---- Start of run_case() ----------------------------------------------------
+def run_case(basecase):
+    # Runs the fault calculation on a single basecase. Returns the case name
+    # used in the csv, and with --psse-arrays the csv rows for the case (None
+    # when the rows are to be parsed from the report). Each case is independent,
+    # so these are run in parallel from a worker pool.
+
+    # Get case name (full name w/o extension) and report file
+    nameCase    = os.path.splitext(basecase)[0]
+    sCaseName   = strReports + nameCase
+    strReport   = sCaseName + dictExt["ext_txt"]
+    arrRows     = None
+
+    # The text report is the csv source unless the results are read from PSS/e
+    # arrays, where it is only written on request for debugging
+    bReport     = (not bPsseArrays) or bDumpReports
+
+    # Start PSS/e on this worker's first case
+    start_psse()
+
+    # Load basecase
+    iErr = psspy.case(basecase)
     
-    # Loop through short circuit basecases
-    for basecase in arrCases:
-        # Get case name (full name w/o extension)
-        nameCase = os.path.splitext(basecase)[0]
-        
-        # Load basecase
-        iErr = psspy.case(basecase)
-        
-        # Set up SC reporting options
-        psspy.short_circuit_units(          ival    = 1)            # physical units
-        psspy.short_circuit_z_units(        ival    = 1)            # physical units
-        psspy.short_circuit_coordinates(    ival    = 1)            # polar coordinates
-        psspy.short_circuit_z_coordinates(  ival    = 0)            # polar coordinates
-        
-        # Set report file
-        psspy.lines_per_page_one_device(    device  = 1,
-                                            ival    = 60)
+    # Set report file
+    if(bReport):
         psspy.report_output(    islct       = 2,
-                                filarg      = strReports + nameCase + dictExt["ext_txt"],
+                                filarg      = strReport,
                                 options1    = 0
                                 )
-        psspy.progress_output(  islct       = 2,
-                                filarg      = strProg + nameCase + dictExt["ext_txt"],
-                                options     = 0
-                                )
-    
+    psspy.progress_output(  islct       = 2,
+                            filarg      = strProg + nameCase + dictExt["ext_txt"],
+                            options     = 0
+                            )
+
+    # Everything PSS/e writes from here goes to the two files above, so point
+    # both back at the console when done. That closes the files, and the report
+    # is complete on disk before the pool hands it back for parsing.
+    try:
         # Set up for SC
         iErr = psspy.flat_2(    options1    = 1,        # classical fault analysis conditions option
                                 options2    = 0,        # tap ratios unchanged
@@ -147,102 +265,207 @@ if __name__ == "__main__":
                                 options7    = 0,        # transformer magnetizing unchanged
                                 options8    = 3         # loads constant, power, and admittance set to 0.0 in all sequence networks
                             )
-        
-        # Set up bus subsystem
+
+        # Set up bus subsystem. Kept per case, as subsystems belong to the
+        # working case loaded above.
         mySid = 1
         psspy.bsys(     sid         = mySid,
                         numbus      = len(arrBuses),
                         buses       = arrBuses
                         )
 
-        # Run fault calculation
-        psspy.iecs_4(   sid         = mySid,
-                        all         = 0,                # process only buses in subsystem SID
-                        status1     = 1,                # include 3ph faults
-                        status2     = 0,                # no lg faults
-                        status3     = 0,                # no llg faults
-                        status4     = 0,                # no ll faults
-                        status5     = 1,                # report total fault currents (mva, amps, impedance, and x/r)
-                        status6     = 0,                # number of levels back
-                        status7     = 0,                # fault at network bus
-                        status8     = 0,                # no line out faults
-                        status9     = 0,                # no line end faults
-                        status10    = 2,                # set tap raiots and phase shift angles to 0 in all seq
-                        status11    = 2,                # set line charging to 0 in all seq
-                        status12    = 2,                # set line, fixed, and switched shunts, and magnetizing admittance to 0 in all seq
-                        status13    = 0,                # DC line and FACTS blocked
-                        status14    = 0,                # ignore zero seq transformer impedance
-                        status15    = 0,                # voltage factor C for max fault currents
-                        status16    = 2,                # set loads to 0 in all seq
-                        status17    = 1                 # use transient reactance
-                        )
+        # Read results straight from PSS/e
+        if(bPsseArrays):
+            arrRows = read_fault_arrays(sCaseName, mySid)
+
+        # Run fault calculation for the report
+        if(bReport):
+            psspy.iecs_4(   sid         = mySid,
+                            all         = 0,                # process only buses in subsystem SID
+                            status1     = 1,                # include 3ph faults
+                            status2     = 0,                # no lg faults
+                            status3     = 0,                # no llg faults
+                            status4     = 0,                # no ll faults
+                            status5     = 1,                # report total fault currents (mva, amps, impedance, and x/r)
+                            status6     = 0,                # number of levels back
+                            status7     = 0,                # fault at network bus
+                            status8     = 0,                # no line out faults
+                            status9     = 0,                # no line end faults
+                            status10    = 2,                # set tap raiots and phase shift angles to 0 in all seq
+                            status11    = 2,                # set line charging to 0 in all seq
+                            status12    = 2,                # set line, fixed, and switched shunts, and magnetizing admittance to 0 in all seq
+                            status13    = 0,                # DC line and FACTS blocked
+                            status14    = 0,                # ignore zero seq transformer impedance
+                            status15    = 0,                # voltage factor C for max fault currents
+                            status16    = 2,                # set loads to 0 in all seq
+                            status17    = 1                 # use transient reactance
+                            )
+    finally:
+        psspy.report_output(    islct       = 1)
+        psspy.progress_output(  islct       = 1)
+
+    return (sCaseName, arrRows)
+
+# ---- End   of run_case() ----------------------------------------------------
 
-        # End of loop: for sFile in fileList
-        
-    # Parse report to csv
-    fReportList = glob.glob(strReports + "*" + dictExt["ext_txt"])
+
+# ---- Start of parse_report() ------------------------------------------------
+def parse_report(sFile):
+    # Parses a single short circuit report and returns its bus records as a
+    # list of tuples in arrCsvHeaders order. Reports are independent, so these
+    # are run in parallel from a worker pool.
+    print("Working on [" + sFile + "]")
+    
+    # Strip extension for output filenames
+    sCaseName = sFile.rsplit(".", 1)[0]
     
-    for sFile in fReportList:
-        print("Working on [" + sFile + "]")
-        
-        # Strip extension for output filenames
-        sCaseName = sFile.rsplit(".", 1)[0]
-        
-        # Open input file, read lines, and close
-        hFileIn     = open(sFile, "r")
-        bufLines    = hFileIn.readlines()
-        hFileIn.close()
-        
-        # Cycle through each line and process if we find a match, starting with
-        # bus number
-        ctrLines    = 0
-        iLen        = len(bufLines)
-        while(ctrLines < iLen):
-            result = re.match(reHeaderLine, bufLines[ctrLines])
-
-            # If bus number is found, process
-            if(result):
-                # Advance to the next line to grab the data
-                ctrLines = ctrLines + 1
-                
-                # Get bus
-                subResult   = re.findall(reBus, bufLines[ctrLines])
-                strBus      = subResult[0]
-                
-                # Get name
-                subResult   = re.findall(reName, bufLines[ctrLines])
-                strName     = subResult[0]
-
-                # Get SC MVA
-                subResult   = re.findall(reMVA, bufLines[ctrLines])
-                strMVA      = subResult[0]
-
-                # Get SC amps
-                subResult   = re.findall(reAmps, bufLines[ctrLines])
-                strAmps      = subResult[0]
-                
-                # Get impedance
-                subResult   = re.findall(reImp, bufLines[ctrLines + 1])
-                strImp      = subResult[0]
-                
-                # Get X/R (next line)
-                subResult   = re.findall(reXR, bufLines[ctrLines + 1])
-                strXR       = subResult[0]
-                
-                print(sCaseName + ":   " + strBus + ": " + strName + ", " + strMVA + ", " + strAmps + ", " + strImp + ", " + strXR)
-
-                # Write to output file
-                fCsv.write(sCaseName + csvDelim)
-                fCsv.write(strBus + csvDelim)
-                fCsv.write(strName + csvDelim)
-                fCsv.write(strMVA + csvDelim)
-                fCsv.write(strAmps + csvDelim)
-                fCsv.write(strXR + csvEOL)
-
-            ctrLines = ctrLines + 1
-        # End of while(ctrLines < iLen)
-
-    # Cleanup
-    fCsv.close()
+    # Rows parsed from this report
+    arrRows     = []
+
+    # Bind globals used per record to locals once up front
+    bHeader     = bHeaderLine
+    sEncoding   = strEncoding
+    appendRow   = arrRows.append
+
+    # mmap cannot map an empty file
+    if(os.path.getsize(sFile) == 0):
+        return arrRows
+
+    # Map the input file and let the regex engine find every bus record in it.
+    # Only the captured fields are ever copied out and decoded.
+    with open(sFile, "rb") as hFileIn, \
+         mmap.mmap(hFileIn.fileno(), 0, access = mmap.ACCESS_READ) as mmIn:
+        iRecords = 0
+        for subRecord in reBusRecord.finditer(mmIn):
+            # Only process headers that start a line
+            iPos = subRecord.start()
+            if(iPos > 0 and mmIn[iPos - 1] != 0x0A):
+                continue
+
+            iRecords = iRecords + 1
+
+            arrFields = subRecord.groups()
+
+            # Queue row for output file, in arrCsvHeaders order. Numbers are
+            # converted once here, which checks each one, and written back with
+            # repr() so none are rounded.
+            appendRow((sCaseName,
+                        arrFields[0].decode(sEncoding),
+                        arrFields[1].decode(sEncoding)
+                        ) + tuple(  repr(float(field))
+                                    for field in arrFields[2:]
+                                    ))
+
+        # End of for subRecord in reBusRecord.finditer(mmIn)
+
+        # A bus whose data or impedance line does not fit the pattern is not
+        # matched at all, so check every header was parsed rather than let the
+        # bus go missing from the csv
+        iHeaders    = 0
+        iPos        = mmIn.find(bHeader)
+        while(iPos >= 0):
+            if(iPos == 0 or mmIn[iPos - 1] == 0x0A):
+                iHeaders = iHeaders + 1
+            iPos        = mmIn.find(bHeader, iPos + 1)
+
+        if(iRecords != iHeaders):
+            raise ValueError(   "[" + sFile + "]: found " + str(iHeaders) + " bus headers but parsed "
+                                + str(iRecords) + " bus records"
+                                )
+
+    return arrRows
+
+# ---- End   of parse_report() ------------------------------------------------
+
+
+# ---- Start of main() --------------------------------------------------------
+if __name__ == "__main__":
+
+    # Setup csv output file
+    strCsv  = "sc_results" + dictExt["ext_csv"]
+    fCsv    = open( strCsv,
+                    "w",
+                    buffering   = csvBufSize,
+                    newline     = ""
+                    )
+    csvOut  = csv.writer(   fCsv,
+                            delimiter       = csvDelim,
+                            lineterminator  = csvEOL
+                            )
+
+    # Anything that fails from here, such as a report parse_report() cannot
+    # read, must not leave a partial csv on disk looking like a full result
+    poolParse   = None
+    bDone       = False
+    try:
+        # Write headers
+        csvOut.writerow(arrCsvHeaders)
+
+        # Run short circuit basecases, one worker process per case
+        iProcs      = min(len(arrCases), os.cpu_count() or 1)
+        arrResults  = []
+        if(iProcs > 0):
+            poolCases   = multiprocessing.Pool(processes = iProcs)
+
+            # Leaving a with block would terminate() the workers. Close and join
+            # instead so they exit on their own, and only terminate when a case
+            # has failed.
+            try:
+                arrResults = poolCases.map(run_case, arrCases)
+                poolCases.close()
+            except BaseException:
+                poolCases.terminate()
+                raise
+            finally:
+                poolCases.join()
+
+        for sCaseName, arrRows in arrResults:
+            print("Finished [" + sCaseName + "]")
+
+        if(bPsseArrays):
+            # Rows already came back from the case runs
+            iterRows    = (arrRows for sCaseName, arrRows in arrResults)
+        else:
+            # Parse reports in parallel and write to csv, one batch per report.
+            # imap hands back each report's rows as soon as it is done, in
+            # order, so the parent holds only the reports in flight rather than
+            # every row at once.
+            fReportList = [ entry.name for entry in os.scandir(".")
+                            if entry.is_file()
+                            and entry.name.startswith(strReports)
+                            and entry.name.endswith(dictExt["ext_txt"])
+                            ]
+
+            # Each spawned worker re-imports PSS/e, so only start as many as
+            # there are reports, and parse in this process when there is just
+            # the one
+            iProcs  = min(len(fReportList), os.cpu_count() or 1)
+            if(iProcs > 1):
+                poolParse   = multiprocessing.Pool(processes = iProcs)
+                iterRows    = poolParse.imap(parse_report, fReportList)
+            else:
+                iterRows    = map(parse_report, fReportList)
+
+        for arrRows in iterRows:
+            csvOut.writerows(arrRows)
+
+            if(bVerbose and arrRows):
+                sys.stdout.write("\n".join(    row[0] + ":   " + row[1] + ": " + ", ".join(row[2:])
+                                                for row in arrRows
+                                                ) + "\n")
+
+        if(poolParse):
+            poolParse.close()
+        bDone = True
+    finally:
+        if(poolParse):
+            if(not bDone):
+                poolParse.terminate()
+            poolParse.join()
+
+        # Cleanup
+        fCsv.close()
+        if(not bDone):
+            os.remove(strCsv)
 
 # ---- End   of main() --------------------------------------------------------